@@ -88,7 +88,8 @@ function closeFile(fileId) {
 createNewFile();
 showAuthModal();
 
-const socket = io();
+const docId = new URLSearchParams(window.location.search).get('doc') || 'doc1';
+const socket = io({ query: { doc: docId } });
 
 const textArea = document.getElementById('text-area');
 const statusDisplay = document.getElementById('connection-status');
@@ -131,6 +132,11 @@ socket.on('operation', (op) => {
     applyOperation(op);
 });
 
+socket.on('operations_batch', (ops) => {
+    console.log(`Received batch of ${ops.length} operations`);
+    applyOperation(ops);
+});
+
 socket.on('operation_error', (data) => {
     console.error('Server reported operation error:', data.error, 'for op:', data.original_op);
     alert(`Error processing your change: ${data.error}`);
@@ -162,7 +168,7 @@ function applyOperation(op) {
     applyingRemoteOp = true;
     const currentCursorPos = textArea.selectionStart;
     const currentScrollTop = textArea.scrollTop;
-        fetch('/api/state')
+        fetch(`/api/state?doc=${encodeURIComponent(docId)}`)
             .then(response => {
                 if (!response.ok) {
                     throw new Error(`HTTP error! status: ${response.status}`);
@@ -209,7 +215,7 @@ textArea.addEventListener('input', (event) => {
 });
 
 function fetchSnapshots() {
-    fetch('/api/snapshots')
+    fetch(`/api/snapshots?doc=${encodeURIComponent(docId)}`)
         .then(response => {
             if (!response.ok) {
                 throw new Error(`HTTP error! status: ${response.status}`);
@@ -1,25 +1,70 @@
 import redis
-import json
+from redis.utils import HIREDIS_AVAILABLE
+import orjson
+import msgpack
 import threading
+import queue
 import time
 import os
-from typing import Callable, Optional, Dict, Any
+import uuid
+from typing import Callable, Optional, Dict, Any, List, Tuple, Set
 
 Operation = Dict[str, Any]
 
+PUBLISH_BATCH_SIZE = 64
+PUBLISH_FLUSH_INTERVAL = 0.002
+LISTEN_MAX_BURST = 1024
+PAYLOAD_REF_THRESHOLD = 4096
+PAYLOAD_REF_TTL = 60
+PAYLOAD_REF_FIELD = "__ref__"
+DISPATCH_QUEUE_SIZE = 1024
+MAX_CONNECTIONS = 16
+
+DECODE_ERRORS = (orjson.JSONDecodeError, msgpack.UnpackException, ValueError)
+
+def _msgpack_dumps(obj: Any) -> bytes:
+    return msgpack.packb(obj, use_bin_type=True)
+
+def _msgpack_loads(data: bytes) -> Any:
+    return msgpack.unpackb(data, raw=False)
+
+CODECS: Dict[str, Tuple[Callable[[Any], bytes], Callable[[bytes], Any]]] = {
+    'msgpack': (_msgpack_dumps, _msgpack_loads),
+    'json': (orjson.dumps, orjson.loads),
+}
+
 class RedisBroker:
     def __init__(self,
                  host: Optional[str] = None,
                  port: Optional[int] = None,
-                 db: int = 0):
+                 db: int = 0,
+                 batch_size: int = PUBLISH_BATCH_SIZE,
+                 flush_interval: float = PUBLISH_FLUSH_INTERVAL,
+                 payload_ref_threshold: int = PAYLOAD_REF_THRESHOLD,
+                 payload_ref_ttl: int = PAYLOAD_REF_TTL,
+                 dispatch_workers: int = 1,
+                 serializer: Optional[str] = None,
+                 max_connections: int = MAX_CONNECTIONS):
 
         resolved_host = host or os.environ.get('REDIS_HOST', 'localhost')
         resolved_port = port or int(os.environ.get('REDIS_PORT', 6379))
+        resolved_serializer = serializer or os.environ.get('BROKER_SERIALIZER', 'msgpack')
+        if resolved_serializer not in CODECS:
+            print(f"Warning: Unknown BROKER_SERIALIZER '{resolved_serializer}', using msgpack.")
+            resolved_serializer = 'msgpack'
+        self.serializer = resolved_serializer
+        self._dumps, self._loads = CODECS[resolved_serializer]
 
         try:
-            self.redis_client = redis.Redis(host=resolved_host, port=resolved_port, db=db, decode_responses=True)
+            # One pool per process: the publisher pipeline, the pubsub
+            # connection and payload GETs all draw from it.
+            self.pool = redis.ConnectionPool(host=resolved_host, port=resolved_port, db=db,
+                                             max_connections=max_connections, decode_responses=False)
+            self.redis_client = redis.Redis(connection_pool=self.pool)
             self.redis_client.ping()
             print(f"Connected to Redis at {resolved_host}:{resolved_port}")
+            if not HIREDIS_AVAILABLE:
+                print("Warning: hiredis not installed, falling back to the pure-Python Redis protocol parser.")
         except redis.ConnectionError as e:
             print(f"Error connecting to Redis ({resolved_host}:{resolved_port}): {e}")
             print("Please ensure Redis server is running or environment variables (REDIS_HOST, REDIS_PORT) are set correctly.")
@@ -33,22 +78,100 @@ class RedisBroker:
         self.pubsub = self.redis_client.pubsub(ignore_subscribe_messages=True)
         self.subscriber_thread = None
         self.is_running = False
-        self._handlers: Dict[str, Callable[[Operation], None]] = {}
+        self._handlers: Dict[str, Callable[..., None]] = {}
+        self._batch_channels: Set[str] = set()
+        self.dispatch_workers = max(1, dispatch_workers)
+        self._dispatch_queues: List[queue.Queue] = []
+        self._dispatch_threads: List[threading.Thread] = []
+
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.payload_ref_threshold = payload_ref_threshold
+        self.payload_ref_ttl = payload_ref_ttl
+        self._pub_queue: queue.SimpleQueue = queue.SimpleQueue()
+        self._pub_running = True
+        self._pub_thread = threading.Thread(target=self._pub_loop, daemon=True)
+        self._pub_thread.start()
 
     def publish(self, channel: str, operation: Operation):
         if not self.redis_client:
             print("Error: Cannot publish, Redis client not connected.")
             return
         try:
-            message = json.dumps(operation)
-            self.redis_client.publish(channel, message)
-
-        except redis.RedisError as e:
-            print(f"Error publishing to Redis channel {channel}: {e}")
+            message = self._dumps(operation)
         except TypeError as e:
             print(f"Error serializing operation for publish: {e}. Operation: {operation}")
+            return
+        self._pub_queue.put((channel, message))
+
+    def publish_many(self, channel: str, operations: List[Operation]):
+        if not self.redis_client:
+            print("Error: Cannot publish, Redis client not connected.")
+            return
+        if not operations:
+            return
+        try:
+            message = self._dumps(operations)
+        except TypeError as e:
+            print(f"Error serializing {len(operations)} operations for publish: {e}")
+            return
+        self._pub_queue.put((channel, message))
+
+    def flush(self, timeout: float = 2.0):
+        if not self.redis_client or not self._pub_thread.is_alive():
+            return
+        done = threading.Event()
+        self._pub_queue.put(done)
+        if not done.wait(timeout):
+            print("Warning: Timed out waiting for Redis publish queue to flush.")
+
+    def _pub_loop(self):
+        pipe = self.redis_client.pipeline(transaction=False)
+        while self._pub_running:
+            try:
+                item = self._pub_queue.get(timeout=1.0)
+            except queue.Empty:
+                continue
+
+            batch: List[Tuple[str, bytes]] = []
+            markers: List[threading.Event] = []
+            deadline = time.monotonic() + self.flush_interval
+            while item is not None:
+                if isinstance(item, threading.Event):
+                    markers.append(item)
+                    break
+                batch.append(item)
+                remaining = deadline - time.monotonic()
+                if len(batch) >= self.batch_size or remaining <= 0:
+                    break
+                try:
+                    item = self._pub_queue.get(timeout=remaining)
+                except queue.Empty:
+                    break
+
+            if batch:
+                self._send_batch(pipe, batch)
+            for marker in markers:
+                marker.set()
 
-    def subscribe(self, channel: str, handler: Callable[[Operation], None]):
+    def _send_batch(self, pipe: redis.client.Pipeline, batch: List[Tuple[str, bytes]]):
+        try:
+            for channel, message in batch:
+                if len(message) > self.payload_ref_threshold:
+                    key = f"payload:{uuid.uuid4()}"
+                    pipe.set(key, message, ex=self.payload_ref_ttl)
+                    message = self._dumps({PAYLOAD_REF_FIELD: key})
+                pipe.publish(channel, message)
+            results = pipe.execute(raise_on_error=False)
+            failed = sum(1 for r in results if isinstance(r, Exception))
+            if failed:
+                print(f"Error publishing {failed} of {len(batch)} messages to Redis.")
+        except redis.RedisError as e:
+            print(f"Error publishing batch of {len(batch)} messages to Redis: {e}")
+        finally:
+            pipe.reset()
+
+    def subscribe(self, channel: str, handler: Callable[..., None], batch: bool = False):
         if not self.redis_client:
             print("Error: Cannot subscribe, Redis client not connected.")
             return
@@ -56,11 +179,16 @@ class RedisBroker:
             print(f"Warning: Handler already registered for channel {channel}. Replacing.")
 
         self._handlers[channel] = handler
+        if batch:
+            self._batch_channels.add(channel)
+        else:
+            self._batch_channels.discard(channel)
         self.pubsub.subscribe(channel)
         print(f"Subscribed to Redis channel: {channel}")
 
         if self.subscriber_thread is None or not self.subscriber_thread.is_alive():
             self.is_running = True
+            self._start_dispatchers()
             self.subscriber_thread = threading.Thread(target=self._listen, daemon=True)
             self.subscriber_thread.start()
             print("Started Redis listener thread.")
@@ -76,22 +204,13 @@ class RedisBroker:
             try:
                 message = self.pubsub.get_message(timeout=1.0)
                 if message:
-
-                    if message['type'] == 'message':
-                        channel = message['channel']
-                        data = message['data']
-
-                        if channel in self._handlers:
-                            try:
-                                operation = json.loads(data)
-                                self._handlers[channel](operation)
-                            except json.JSONDecodeError as e:
-                                print(f"Error decoding JSON from channel {channel}: {e}. Data: {data}")
-                            except Exception as e:
-                                print(f"Error in handler for channel {channel}: {e}")
-                        else:
-                            print(f"Warning: Received message on unhandled channel {channel}")
-
+                    burst = [message]
+                    while len(burst) < LISTEN_MAX_BURST:
+                        message = self.pubsub.get_message(timeout=0)
+                        if message is None:
+                            break
+                        burst.append(message)
+                    self._enqueue_burst(burst)
 
             except redis.ConnectionError as e:
                 print(f"Redis connection error in listener thread: {e}. Attempting to reconnect...")
@@ -111,13 +230,106 @@ class RedisBroker:
         except Exception as e:
             print(f"Error closing pubsub: {e}")
 
+    def _start_dispatchers(self):
+        if any(t.is_alive() for t in self._dispatch_threads):
+            return
+        self._dispatch_queues = [queue.Queue(maxsize=DISPATCH_QUEUE_SIZE) for _ in range(self.dispatch_workers)]
+        self._dispatch_threads = [
+            threading.Thread(target=self._dispatch_loop, args=(q,), daemon=True)
+            for q in self._dispatch_queues
+        ]
+        for t in self._dispatch_threads:
+            t.start()
+
+    def _enqueue_burst(self, messages: List[Dict[str, Any]]):
+        # Channels are pinned to one worker so per-channel order survives.
+        if len(self._dispatch_queues) == 1:
+            self._dispatch_queues[0].put(messages)
+            return
+        shards: Dict[int, List[Dict[str, Any]]] = {}
+        for message in messages:
+            shard = hash(message['channel']) % len(self._dispatch_queues)
+            shards.setdefault(shard, []).append(message)
+        for shard, shard_messages in shards.items():
+            self._dispatch_queues[shard].put(shard_messages)
+
+    def _dispatch_loop(self, messages_queue: queue.Queue):
+        while True:
+            messages = messages_queue.get()
+            if messages is None:
+                break
+            try:
+                self._dispatch(messages)
+            except Exception as e:
+                print(f"Unexpected error in Redis dispatch worker: {e}")
+
+    def _dispatch(self, messages: List[Dict[str, Any]]):
+        batches: Dict[str, List[Operation]] = {}
+        for message in messages:
+            if message['type'] != 'message':
+                continue
+            channel = message['channel'].decode()
+            data = message['data']
+
+            if channel not in self._handlers:
+                print(f"Warning: Received message on unhandled channel {channel}")
+                continue
+            try:
+                operation = self._loads(data)
+                if isinstance(operation, dict) and PAYLOAD_REF_FIELD in operation:
+                    key = operation[PAYLOAD_REF_FIELD]
+                    data = self.redis_client.get(key)
+                    if data is None:
+                        print(f"Warning: Referenced payload {key} on channel {channel} expired or missing.")
+                        continue
+                    operation = self._loads(data)
+            except DECODE_ERRORS as e:
+                print(f"Error decoding {self.serializer} message from channel {channel}: {e}. Data: {data}")
+                continue
+            except redis.RedisError as e:
+                print(f"Error fetching referenced payload on channel {channel}: {e}")
+                continue
+
+            # publish_many sends a list of operations as one message.
+            operations = operation if isinstance(operation, list) else [operation]
+            if channel in self._batch_channels:
+                batches.setdefault(channel, []).extend(operations)
+                continue
+            for operation in operations:
+                try:
+                    self._handlers[channel](operation)
+                except Exception as e:
+                    print(f"Error in handler for channel {channel}: {e}")
+
+        for channel, operations in batches.items():
+            try:
+                self._handlers[channel](operations)
+            except Exception as e:
+                print(f"Error in batch handler for channel {channel}: {e}")
+
     def stop(self):
         print("Stopping RedisBroker...")
+        if not self.redis_client:
+            print("RedisBroker stopped.")
+            return
+        self.flush()
+        self._pub_running = False
+        self._pub_queue.put(None)
+        self._pub_thread.join(timeout=2.0)
+        if self._pub_thread.is_alive():
+            print("Warning: Redis publisher thread did not stop cleanly.")
         self.is_running = False
         if self.subscriber_thread and self.subscriber_thread.is_alive():
             self.subscriber_thread.join(timeout=2.0)
             if self.subscriber_thread.is_alive():
                 print("Warning: Redis listener thread did not stop cleanly.")
+        for q in self._dispatch_queues:
+            q.put(None)
+        for t in self._dispatch_threads:
+            t.join(timeout=2.0)
+            if t.is_alive():
+                print("Warning: Redis dispatch worker did not stop cleanly.")
+        self.pool.disconnect()
         print("RedisBroker stopped.")
 
 
@@ -1,27 +1,85 @@
+import sys
 import uuid
 import time
-import json
-from typing import Dict, Tuple, Optional, List, Any
-
-ElementID = Tuple[float, str]
+import bisect
+from operator import attrgetter
+from types import MappingProxyType
+from typing import Dict, Tuple, Optional, List, Any, Set, Mapping
+
+ElementID = Tuple[int, str]
+
+# A remote batch carrying at least 1/N of the document's element count is
+# applied without splicing; one traversal afterwards is cheaper.
+BATCH_REBUILD_RATIO = 64
+
+_element_id = attrgetter('id')
+
+def _valid_id(x: Any) -> bool:
+    return isinstance(x, (list, tuple)) and len(x) == 2 and isinstance(x[1], str)
+
+def _insert_sort_key(operation: Dict[str, Any]) -> Tuple[int, str]:
+    element_id = operation["start_id"] if operation["type"] == "insert_range" else operation["element"]["id"]
+    return (element_id[0], element_id[1])
+
+def _insert_size(operation: Dict[str, Any]) -> int:
+    value = operation.get("value")
+    return len(value) if operation["type"] == "insert_range" and isinstance(value, str) else 1
+
+def _id_runs(elements: List['Element']) -> List[List[Any]]:
+    # Consecutive timestamps from one site collapse into [ts, site, count],
+    # so deleting text that arrived as one insert_range is a single entry.
+    runs: List[List[Any]] = []
+    for element in elements:
+        ts, sid = element.id
+        if runs and runs[-1][1] == sid and runs[-1][0] + runs[-1][2] == ts:
+            runs[-1][2] += 1
+        else:
+            runs.append([ts, sid, 1])
+    return runs
+
+def _expand_runs(runs: Any) -> List[ElementID]:
+    element_ids: List[ElementID] = []
+    for ts, sid, count in runs:
+        if not isinstance(ts, int) or not isinstance(sid, str) or not isinstance(count, int):
+            raise TypeError(f"invalid run {[ts, sid, count]}")
+        sid = sys.intern(sid)
+        element_ids.extend([(ts + k, sid) for k in range(count)])
+    return element_ids
 
 def stringify_keys(d: Dict) -> Dict[str, Any]:
-    return {json.dumps(k): v for k, v in d.items()}
+    return {f"{k[0]}|{k[1]}": v for k, v in d.items()}
 
 def tuplefy_keys(d: Dict[str, Any]) -> Dict[ElementID, Any]:
     res = {}
     for k_str, v in d.items():
         try:
-            key_tuple = tuple(json.loads(k_str))
-            if isinstance(key_tuple, tuple) and len(key_tuple) == 2 and isinstance(key_tuple[1], str):
-                 res[key_tuple] = v
-            else:
-                 print(f"Warning: Skipping invalid key during tuplefy: {k_str}")
-        except (json.JSONDecodeError, TypeError) as e:
+            ts_str, sid = k_str.split('|', 1)
+            res[(int(ts_str), sid)] = v
+        except ValueError as e:
             print(f"Warning: Error converting key {k_str} to tuple: {e}")
     return res
 
+def _traverse(children: Dict[ElementID, List['Element']], start: 'Element') -> List['Element']:
+    # Every element has exactly one predecessor, so the graph reachable
+    # from start is a tree and no node can be visited twice.
+    stack = [start]
+    order: List['Element'] = []
+    pop = stack.pop
+    extend = stack.extend
+    emit = order.append
+    get_children = children.get
+
+    while stack:
+        current = pop()
+        emit(current)
+        kids = get_children(current.id)
+        if kids:
+            extend(kids)
+    return order
+
 class Element:
+    __slots__ = ('id', 'value', 'predecessor_id', 'is_tombstone', '_cached_dict')
+
     def __init__(self,
                  element_id: ElementID,
                  value: Optional[str],
@@ -31,6 +89,7 @@ class Element:
         self.value = value
         self.predecessor_id = predecessor_id
         self.is_tombstone = is_tombstone
+        self._cached_dict: Optional[Dict[str, Any]] = None
 
     def __repr__(self):
         val = f"'{self.value}'" if self.value is not None else 'SENTINEL'
@@ -38,52 +97,81 @@ class Element:
         return f"Element(id={self.id}, val={val}, pred={self.predecessor_id}{tomb})"
 
     def to_dict(self) -> Dict[str, Any]:
-        
-        return {
-            'id': self.id,
-            'value': self.value,
-            'predecessor_id': self.predecessor_id,
-            'is_tombstone': self.is_tombstone
-        }
+        # The dict is shared between calls; callers must not mutate it.
+        cached = self._cached_dict
+        if cached is None or cached['is_tombstone'] != self.is_tombstone:
+            cached = self._cached_dict = {
+                'id': self.id,
+                'value': self.value,
+                'predecessor_id': self.predecessor_id,
+                'is_tombstone': self.is_tombstone
+            }
+        return cached
 
     @staticmethod
     def from_dict(data: Dict[str, Any]) -> 'Element':
         
+        ts, sid = data['id']
+        pred = data['predecessor_id']
         return Element(
-            element_id=tuple(data['id']),
+            element_id=(ts, sys.intern(sid)),
             value=data['value'],
-            predecessor_id=tuple(data['predecessor_id']) if data['predecessor_id'] else None,
+            predecessor_id=(pred[0], sys.intern(pred[1])) if pred else None,
             is_tombstone=data.get('is_tombstone', False)
         )
 
 Operation = Dict[str, Any]
 
 class RGA:
-    START_SENTINEL_ID: ElementID = (-1.0, "START")
+    START_SENTINEL_ID: ElementID = (-1, "START")
 
     def __init__(self, site_id: str | None = None):
-        self.site_id = site_id or str(uuid.uuid4())
+        self.site_id = sys.intern(site_id or str(uuid.uuid4()))
         self.elements_by_id: Dict[ElementID, Element] = {}
         start_element = Element(self.START_SENTINEL_ID, None, None)
         self.elements_by_id[self.START_SENTINEL_ID] = start_element
-        self._local_clock = 0.0
+        self._local_clock = time.monotonic_ns()
+        self._ordered_cache: Optional[List[Element]] = None
+        self._dirty = True
+        self._value_cache: Optional[str] = None
+        # Position of the most recently spliced element; typing runs make
+        # it the anchor of the next insert, which skips the list.index scan.
+        self._visible_hint = 0
+        self._children: Dict[ElementID, List[Element]] = {}
+        self._detached: Set[ElementID] = set()
 
     def get_state(self) -> Dict[ElementID, Element]:
         
         return self.elements_by_id.copy()
 
+    def view_state(self) -> Mapping[ElementID, Element]:
+        
+        return MappingProxyType(self.elements_by_id)
+
     def set_state(self, state: Dict[ElementID, Element]):
         
         if self.START_SENTINEL_ID not in state:
             raise ValueError("Invalid state: START_SENTINEL missing.")
         self.elements_by_id = state.copy()
+        self._observe_clock()
+        self._rebuild_children()
+        self._dirty = True
+        self._value_cache = None
 
     def serialize_state(self) -> Dict[str, Any]:
         
-        serialized_elements = {json.dumps(k): v.to_dict() for k, v in self.elements_by_id.items()}
+        serialized_elements = [
+            [
+                e.id[0], e.id[1], e.value,
+                e.predecessor_id[0] if e.predecessor_id else None,
+                e.predecessor_id[1] if e.predecessor_id else None,
+                e.is_tombstone
+            ]
+            for e in self.elements_by_id.values()
+        ]
         return {
             "site_id": self.site_id,
-            "elements_by_id": serialized_elements
+            "elements": serialized_elements
         }
 
     @classmethod
@@ -92,17 +180,19 @@ class RGA:
         site_id = data.get("site_id", str(uuid.uuid4()))
         rga = cls(site_id=site_id)
 
-        elements_data = data.get("elements_by_id", {})
+        elements_data = data.get("elements", [])
         deserialized_elements = {}
-        for k_str, elem_dict in elements_data.items():
+        for row in elements_data:
             try:
-                key_tuple = tuple(json.loads(k_str))
-                if isinstance(key_tuple, tuple) and len(key_tuple) == 2 and isinstance(key_tuple[1], str):
-                     deserialized_elements[key_tuple] = Element.from_dict(elem_dict)
-                else:
-                     print(f"Warning: Skipping invalid key during state deserialization: {k_str}")
-            except (json.JSONDecodeError, TypeError, KeyError, ValueError) as e:
-                print(f"Warning: Error converting key/element {k_str} during state deserialization: {e}")
+                ts, sid, value, pred_ts, pred_sid, is_tombstone = row
+                if not isinstance(sid, str):
+                     print(f"Warning: Skipping invalid element row during state deserialization: {row}")
+                     continue
+                element_id = (ts, sys.intern(sid))
+                predecessor_id = (pred_ts, sys.intern(pred_sid)) if pred_sid is not None else None
+                deserialized_elements[element_id] = Element(element_id, value, predecessor_id, bool(is_tombstone))
+            except (TypeError, ValueError) as e:
+                print(f"Warning: Error converting element row {row} during state deserialization: {e}")
 
         if cls.START_SENTINEL_ID not in deserialized_elements:
              print(f"Warning: START_SENTINEL missing in deserialized state for site {site_id}. Adding default.")
@@ -110,59 +200,119 @@ class RGA:
              deserialized_elements[cls.START_SENTINEL_ID] = start_element
 
         rga.elements_by_id = deserialized_elements
+        rga._observe_clock()
+        rga._rebuild_children()
+        rga._dirty = True
         return rga
 
     def _generate_id(self) -> ElementID:
-        ts = time.time()
-        self._local_clock = max(self._local_clock + 0.000001, ts)
+        # The clock is always past every ID this replica has seen, so a
+        # fresh ID can never collide with an existing one.
+        self._local_clock += 1
         return (self._local_clock, self.site_id)
 
+    def _observe_clock(self):
+        for ts, _ in self.elements_by_id.keys():
+            if isinstance(ts, (float, int)) and ts > self._local_clock:
+                self._local_clock = ts
+
+    def _rebuild_children(self):
+        children: Dict[ElementID, List[Element]] = {}
+        for elem in sorted(self.elements_by_id.values(), key=_element_id):
+            if elem.predecessor_id is not None:
+                children.setdefault(elem.predecessor_id, []).append(elem)
+        self._children = children
+
+    def _last_descendant(self, elem: Element) -> Element:
+        # Traversal visits siblings newest-first, so the last node of a
+        # subtree is reached by repeatedly taking the oldest child.
+        while True:
+            kids = self._children.get(elem.id)
+            if not kids:
+                return elem
+            elem = kids[0]
+
+    def _preceding(self, elem: Element) -> Element:
+        siblings = self._children[elem.predecessor_id]
+        i = bisect.bisect_left(siblings, elem.id, key=_element_id)
+        if i + 1 < len(siblings):
+            return self._last_descendant(siblings[i + 1])
+        return self.elements_by_id[elem.predecessor_id]
+
+    def _splice_remote_insert(self, new_element: Element):
+        siblings = self._children.setdefault(new_element.predecessor_id, [])
+        k = bisect.bisect_left(siblings, new_element.id, key=_element_id)
+        anchor = self._last_descendant(siblings[k]) if k < len(siblings) else self.elements_by_id[new_element.predecessor_id]
+        siblings.insert(k, new_element)
+        self._value_cache = None
+
+        if self._dirty or self._ordered_cache is None:
+            return
+        if new_element.id in self._children:
+            # Children of this element arrived before it; their subtree is
+            # reachable now, so the whole order has to be recomputed. This
+            # holds even when the element itself arrives tombstoned.
+            self._dirty = True
+            return
+        if new_element.is_tombstone:
+            return
+
+        self._insert_visible_after(new_element, anchor)
+
+    def _insert_visible_after(self, elem: Element, anchor: Element):
+        node = anchor
+        while node.id != self.START_SENTINEL_ID and node.is_tombstone:
+            node = self._preceding(node)
+        visible = self._ordered_cache
+        hint = self._visible_hint
+        if node.id == self.START_SENTINEL_ID:
+            pos = 0
+        elif hint < len(visible) and visible[hint] is node:
+            pos = hint + 1
+        elif visible and visible[-1] is node:
+            pos = len(visible)
+        else:
+            pos = visible.index(node) + 1
+        visible.insert(pos, elem)
+        self._visible_hint = pos
+
+    def _remove_visible(self, elem: Element):
+        visible = self._ordered_cache
+        hint = self._visible_hint
+        for pos in (hint, hint + 1, hint - 1):
+            if 0 <= pos < len(visible) and visible[pos] is elem:
+                break
+        else:
+            pos = visible.index(elem)
+        del visible[pos]
+        self._visible_hint = max(pos - 1, 0)
+
     def _get_ordered_visible_elements(self) -> List[Element]:
         
-        pred_to_succ_map: Dict[Optional[ElementID], List[Element]] = {}
-        for elem in self.elements_by_id.values():
-            pred_id = elem.predecessor_id
-            if pred_id not in pred_to_succ_map:
-                pred_to_succ_map[pred_id] = []
-            pred_to_succ_map[pred_id].append(elem)
-
-        for pred_id in pred_to_succ_map:
-            pred_to_succ_map[pred_id].sort(key=lambda x: x.id)
-
-        result_sequence = []
-        stack = [self.START_SENTINEL_ID]
-        visited_during_sort = set()
-        processed_in_order = []
-
-        while stack:
-            current_id = stack.pop()
-
-            if current_id in visited_during_sort:
-                 print(f"Warning: Cycle detected or node revisited during sort: {current_id}")
-                 continue
-            visited_during_sort.add(current_id)
-
-            current_elem = self.elements_by_id.get(current_id)
-            if not current_elem:
-                print(f"Error: Element {current_id} referenced but not found during traversal.")
-                continue
-
-            processed_in_order.append(current_elem)
-            successors = sorted(pred_to_succ_map.get(current_id, []), key=lambda x: x.id, reverse=True)
-            for succ in successors:
-                 if succ.id not in visited_during_sort:
-                    stack.append(succ.id)
-
-        visible_sequence = [
-            elem for elem in processed_in_order
-            if not elem.is_tombstone and elem.id != self.START_SENTINEL_ID
-        ]
+        if not self._dirty and self._ordered_cache is not None:
+            return self._ordered_cache
+
+        order = _traverse(self._children, self.elements_by_id[self.START_SENTINEL_ID])
+        visible_sequence = [elem for elem in order[1:] if not elem.is_tombstone]
+        if len(order) < len(self.elements_by_id):
+            reached = {elem.id for elem in order}
+            self._detached = {eid for eid in self.elements_by_id if eid not in reached}
+        else:
+            self._detached = set()
+        self._ordered_cache = visible_sequence
+        self._dirty = False
         return visible_sequence
 
     def get_value(self) -> str:
         
-        visible_elements = self._get_ordered_visible_elements()
-        return "".join(elem.value for elem in visible_elements if elem.value is not None)
+        if self._value_cache is None:
+            visible_elements = self._get_ordered_visible_elements()
+            self._value_cache = "".join([elem.value for elem in visible_elements])
+        return self._value_cache
+
+    def get_length(self) -> int:
+        
+        return len(self._get_ordered_visible_elements())
 
     def local_insert(self, index: int, value: str) -> Operation:
         
@@ -178,25 +328,60 @@ class RGA:
         elif index <= len(visible_elements):
             predecessor_id = visible_elements[index - 1].id
         else:
-            if index == len(visible_elements):
-                 predecessor_id = visible_elements[-1].id if visible_elements else self.START_SENTINEL_ID
-            else:
-                raise IndexError(f"Insertion index {index} out of bounds for length {len(visible_elements)}")
+            raise IndexError(f"Insertion index {index} out of bounds for length {len(visible_elements)}")
 
         new_id = self._generate_id()
         new_element = Element(new_id, value, predecessor_id)
 
-        if new_id in self.elements_by_id:
-            print(f"Warning: Element ID collision: {new_id}. Re-generating.")
-            time.sleep(0.001)
-            new_id = self._generate_id()
-            if new_id in self.elements_by_id:
-                 raise RuntimeError(f"Persistent Element ID collision for site {self.site_id}. Clock issue?")
-            new_element = Element(new_id, value, predecessor_id)
-
         self.elements_by_id[new_id] = new_element
+        # A fresh ID is newer than every sibling, so appending keeps the order.
+        self._children.setdefault(predecessor_id, []).append(new_element)
+        visible_elements.insert(index, new_element)
+        self._visible_hint = index
+        self._value_cache = None
         return {"type": "insert", "element": new_element.to_dict()}
 
+    def local_insert_range(self, index: int, text: str) -> Operation:
+        
+        if not isinstance(text, str) or not text:
+             raise ValueError("Insertion text must be a non-empty string.")
+        if index < 0:
+            raise IndexError("Index cannot be negative")
+
+        visible_elements = self._get_ordered_visible_elements()
+
+        if index == 0:
+            predecessor_id = self.START_SENTINEL_ID
+        elif index <= len(visible_elements):
+            predecessor_id = visible_elements[index - 1].id
+        else:
+            raise IndexError(f"Insertion index {index} out of bounds for length {len(visible_elements)}")
+
+        # The run gets consecutive IDs, each character hanging off the one
+        # before it, so the op only needs the first ID and the predecessor.
+        start_ts = self._local_clock + 1
+        self._local_clock += len(text)
+        new_elements = []
+        pred = predecessor_id
+        for k, char in enumerate(text):
+            new_element = Element((start_ts + k, self.site_id), char, pred)
+            self.elements_by_id[new_element.id] = new_element
+            new_elements.append(new_element)
+            pred = new_element.id
+        self._children.setdefault(predecessor_id, []).append(new_elements[0])
+        for parent, child in zip(new_elements, new_elements[1:]):
+            self._children[parent.id] = [child]
+
+        visible_elements[index:index] = new_elements
+        self._visible_hint = index + len(text) - 1
+        self._value_cache = None
+        return {
+            "type": "insert_range",
+            "start_id": new_elements[0].id,
+            "predecessor_id": predecessor_id,
+            "value": text
+        }
+
     def local_delete(self, index: int) -> Operation:
         
         if index < 0:
@@ -212,11 +397,64 @@ class RGA:
         if element_to_delete.is_tombstone:
             return {"type": "noop", "reason": "element already deleted"}
 
-        if element_to_delete.id == self.START_SENTINEL_ID:
-             raise ValueError("Cannot delete the START sentinel.")
-
         element_to_delete.is_tombstone = True
-        return {"type": "delete", "element_id": element_to_delete.id}
+        del visible_elements[index]
+        self._visible_hint = max(index - 1, 0)
+        self._value_cache = None
+        # The element ID names its creator, not the deleting site.
+        return {"type": "delete", "element_id": element_to_delete.id, "origin": self.site_id}
+
+    def local_delete_range(self, start: int, end: int) -> Operation:
+        
+        if start < 0:
+            raise IndexError("Index cannot be negative")
+
+        visible_elements = self._get_ordered_visible_elements()
+        end = min(end, len(visible_elements))
+
+        if start >= end:
+            return {"type": "noop", "reason": "delete range empty or out of bounds"}
+
+        deleted = visible_elements[start:end]
+        for element in deleted:
+            element.is_tombstone = True
+        del visible_elements[start:end]
+        self._visible_hint = max(start - 1, 0)
+        self._value_cache = None
+        return {"type": "delete_range", "runs": _id_runs(deleted), "origin": self.site_id}
+
+    def _apply_remote_insert(self, new_element: Element, warn_missing: bool = True):
+        if new_element.id in self.elements_by_id:
+            existing_element = self.elements_by_id[new_element.id]
+            if existing_element.is_tombstone:
+                print(f"Remote insert: Re-activating existing tombstoned element {new_element.id}")
+                existing_element.is_tombstone = False
+                self._value_cache = None
+                if not self._dirty and self._ordered_cache is not None and new_element.id not in self._detached:
+                    self._insert_visible_after(existing_element, self._preceding(existing_element))
+            else:
+                pass
+            return
+
+        self.elements_by_id[new_element.id] = new_element
+        if isinstance(new_element.id[0], (float, int)) and new_element.id[0] > self._local_clock:
+            self._local_clock = new_element.id[0]
+
+        if new_element.predecessor_id not in self.elements_by_id or new_element.predecessor_id in self._detached:
+            if warn_missing:
+                print(f"Warning: Remote insert: Predecessor {new_element.predecessor_id} for element {new_element.id} not found. Op might be applied out of order or lost.")
+            bisect.insort(self._children.setdefault(new_element.predecessor_id, []), new_element, key=_element_id)
+            self._detached.add(new_element.id)
+            return
+
+        self._splice_remote_insert(new_element)
+
+    def _apply_remote_delete(self, element_to_delete: Optional[Element]):
+        if element_to_delete is not None and not element_to_delete.is_tombstone:
+            element_to_delete.is_tombstone = True
+            self._value_cache = None
+            if not self._dirty and self._ordered_cache is not None and element_to_delete.id not in self._detached:
+                self._remove_visible(element_to_delete)
 
     def apply_remote_operation(self, operation: Operation):
         
@@ -234,61 +472,122 @@ class RGA:
                  print(f"Warning: Failed to deserialize element from remote insert op: {e}, data: {element_data}")
                  return
 
-            if new_element.id in self.elements_by_id:
-                existing_element = self.elements_by_id[new_element.id]
-                if existing_element.is_tombstone:
-                    print(f"Remote insert: Re-activating existing tombstoned element {new_element.id}")
-                    existing_element.is_tombstone = False
-                else:
-                    pass
-                return
+            self._apply_remote_insert(new_element)
 
-            if new_element.predecessor_id not in self.elements_by_id:
-                print(f"Warning: Remote insert: Predecessor {new_element.predecessor_id} for element {new_element.id} not found. Op might be applied out of order or lost.")
+        elif op_type == "insert_range":
+            try:
+                ts, sid = operation["start_id"]
+                pred_ts, pred_sid = operation["predecessor_id"]
+                value = operation["value"]
+                sid = sys.intern(sid)
+                predecessor_id = (pred_ts, sys.intern(pred_sid))
+                if not isinstance(ts, int) or not isinstance(value, str):
+                    raise TypeError("start timestamp must be an int and value a string")
+            except (KeyError, TypeError, ValueError) as e:
+                print(f"Warning: Failed to parse remote insert_range op: {e}, op: {operation}")
+                return
 
-            self.elements_by_id[new_element.id] = new_element
+            for k, char in enumerate(value):
+                element_id = (ts + k, sid)
+                # Only the head of the run can be missing its predecessor.
+                self._apply_remote_insert(Element(element_id, char, predecessor_id), warn_missing=(k == 0))
+                predecessor_id = element_id
 
         elif op_type == "delete":
-            element_id_tuple: Optional[ElementID] = None
-            element_id_raw = operation.get("element_id")
-            if isinstance(element_id_raw, (list, tuple)) and len(element_id_raw) == 2:
-                 try:
-                     ts = float(element_id_raw[0])
-                     sid = str(element_id_raw[1])
-                     element_id_tuple = (ts, sid)
-                 except (ValueError, TypeError) as e:
-                      print(f"Warning: Error converting element_id {element_id_raw} to tuple: {e}")
-            elif element_id_raw is not None:
-                 print(f"Warning: Received delete operation with malformed element_id: {element_id_raw}")
-
-            if not element_id_tuple:
-                print("Warning: Received delete operation with missing or invalid element_id.")
+            try:
+                ts, sid = operation["element_id"]
+                element_to_delete = self.elements_by_id.get((ts, sys.intern(sid)))
+            except (KeyError, TypeError, ValueError):
+                print(f"Warning: Received delete operation with missing or invalid element_id: {operation.get('element_id')}")
                 return
 
-            if element_id_tuple in self.elements_by_id:
-                element_to_delete = self.elements_by_id[element_id_tuple]
-                if not element_to_delete.is_tombstone:
-                    element_to_delete.is_tombstone = True
-            
+            self._apply_remote_delete(element_to_delete)
+
+        elif op_type == "delete_range":
+            try:
+                element_ids = _expand_runs(operation["runs"])
+            except (KeyError, TypeError, ValueError) as e:
+                print(f"Warning: Received delete_range operation with missing or invalid runs: {e}")
+                return
+
+            get_element = self.elements_by_id.get
+            for element_id in element_ids:
+                # In document order, so each removal is found next to the hint.
+                self._apply_remote_delete(get_element(element_id))
 
         elif op_type == "noop":
             pass
         else:
             print(f"Warning: Received unknown operation type: {op_type}")
 
+    def apply_remote_operations(self, operations: List[Operation]):
+        
+        inserts: List[Operation] = []
+        deletes: List[Any] = []
+        for operation in operations:
+            op_type = operation.get("type")
+            if op_type == "insert" and _valid_id((operation.get("element") or {}).get("id")):
+                inserts.append(operation)
+            elif op_type == "insert_range" and _valid_id(operation.get("start_id")):
+                inserts.append(operation)
+            elif op_type == "delete" and _valid_id(operation.get("element_id")):
+                deletes.append(operation["element_id"])
+            elif op_type == "delete_range":
+                try:
+                    deletes.extend(_expand_runs(operation["runs"]))
+                except (KeyError, TypeError, ValueError) as e:
+                    print(f"Warning: Received delete_range operation with missing or invalid runs: {e}")
+            else:
+                self.apply_remote_operation(operation)
+
+        # IDs are Lamport-ordered (a site's clock passes every ID it has
+        # seen), so sorting by ID puts every predecessor before its successors.
+        try:
+            inserts.sort(key=_insert_sort_key)
+        except TypeError as e:
+            print(f"Warning: Could not order remote insert batch, applying in arrival order: {e}")
+        if sum(map(_insert_size, inserts)) * BATCH_REBUILD_RATIO >= len(self.elements_by_id):
+            self._dirty = True
+        for operation in inserts:
+            self.apply_remote_operation(operation)
+
+        # Small delete bursts use the hinted per-element removal; large ones
+        # tombstone everything and filter the cached list once.
+        bulk_delete = len(deletes) * BATCH_REBUILD_RATIO >= len(self.elements_by_id)
+        deleted_any = False
+        for element_id in deletes:
+            try:
+                ts, sid = element_id
+                element_to_delete = self.elements_by_id.get((ts, sys.intern(sid)))
+            except (TypeError, ValueError):
+                print(f"Warning: Received delete operation with invalid element_id: {element_id}")
+                continue
+            if not bulk_delete:
+                self._apply_remote_delete(element_to_delete)
+            elif element_to_delete is not None and not element_to_delete.is_tombstone:
+                element_to_delete.is_tombstone = True
+                deleted_any = True
+        if deleted_any:
+            self._value_cache = None
+            if not self._dirty and self._ordered_cache is not None:
+                self._ordered_cache = [elem for elem in self._ordered_cache if not elem.is_tombstone]
+
     def load_state(self, serialized_state: Dict[str, Any]):
         
-        if "site_id" not in serialized_state or "elements_by_id" not in serialized_state:
+        if "site_id" not in serialized_state or "elements" not in serialized_state:
             raise ValueError("Invalid serialized state format.")
 
         new_rga = RGA.deserialize_state(serialized_state)
         self.site_id = new_rga.site_id
         self.elements_by_id = new_rga.elements_by_id
-        max_ts = 0.0
+        self._children = new_rga._children
+        self._dirty = True
+        self._value_cache = None
+        max_ts = 0
         for ts, _ in self.elements_by_id.keys():
              if isinstance(ts, (float, int)) and ts > max_ts:
                  max_ts = ts
-        self._local_clock = max_ts
+        self._local_clock = max(max_ts, time.monotonic_ns())
 
 if __name__ == "__main__":
     site1 = RGA(site_id="site1")
@@ -343,4 +642,71 @@ if __name__ == "__main__":
     site3 = RGA.deserialize_state(serialized_state)
     print(f"Site3 deserialized value: {site3.get_value()}")
     assert site3.get_value() == site1.get_value(), "Deserialization failed!"
-    print("Serialization/Deserialization OK.")
\ No newline at end of file
+    print("Serialization/Deserialization OK.")
+
+    print("Testing convergence under random concurrent edits...")
+    import json
+    import random
+
+    def _rebuilt_value(site: RGA) -> str:
+        return RGA.deserialize_state(site.serialize_state()).get_value()
+
+    def _deliver(site: RGA, ops: List[Operation], rnd: random.Random, batched: bool):
+        if batched:
+            ops = ops[:]
+            rnd.shuffle(ops)
+            site.apply_remote_operations(ops)
+            return
+        # Inserts of a chunk arrive newest first, so children precede their
+        # predecessors; deletes follow once their targets exist.
+        inserts = [op for op in ops if op["type"] in ("insert", "insert_range")]
+        for op in reversed(inserts):
+            site.apply_remote_operation(op)
+        for op in ops:
+            if op["type"] not in ("insert", "insert_range"):
+                site.apply_remote_operation(op)
+
+    for seed in range(40):
+        rnd = random.Random(seed)
+        batched = seed % 2 == 1
+        sites = [RGA(site_id=f"fuzz{i}") for i in range(3)]
+        inboxes: List[List[Operation]] = [[] for _ in sites]
+        for _ in range(200):
+            i = rnd.randrange(len(sites))
+            site = sites[i]
+            value = site.get_value()
+            action = rnd.random()
+            if action < 0.25:
+                index = rnd.randint(0, len(value))
+                op = site.local_insert(index, rnd.choice("abc"))
+            elif action < 0.5:
+                index = rnd.randint(0, len(value))
+                text = "".join(rnd.choices("XYZ", k=rnd.randint(1, 6)))
+                op = site.local_insert_range(index, text)
+                assert site.get_value() == value[:index] + text + value[index:], "Local insert_range misplaced!"
+            elif action < 0.6 and value:
+                op = site.local_delete(rnd.randrange(len(value)))
+            elif action < 0.75:
+                start = rnd.randint(0, len(value))
+                end = start + rnd.randint(0, 8)
+                op = site.local_delete_range(start, end)
+                assert site.get_value() == value[:start] + value[end:], "Local delete_range removed the wrong text!"
+            else:
+                j = rnd.randrange(len(sites))
+                k = rnd.randint(0, len(inboxes[j]))
+                _deliver(sites[j], inboxes[j][:k], rnd, batched)
+                del inboxes[j][:k]
+                assert sites[j].get_value() == _rebuilt_value(sites[j]), f"Cached value diverged from rebuild (seed {seed})!"
+                continue
+            # Ops travel as JSON between servers in practice.
+            op = json.loads(json.dumps(op))
+            for j in range(len(sites)):
+                if j != i:
+                    inboxes[j].append(op)
+
+        for j, site in enumerate(sites):
+            _deliver(site, inboxes[j], rnd, batched)
+        values = {site.get_value() for site in sites}
+        assert len(values) == 1, f"Convergence failed under random edits (seed {seed})!"
+        assert all(site.get_value() == _rebuilt_value(site) for site in sites), f"Cached value diverged from rebuild (seed {seed})!"
+    print("Convergence OK under random concurrent edits.")
@@ -1,12 +1,23 @@
+try:
+    # Must run before anything else imports socket, ssl or threading.
+    from gevent import monkey
+    monkey.patch_all()
+    ASYNC_MODE = 'gevent'
+except ImportError:
+    ASYNC_MODE = 'threading'
+
 import sys
 import os
 from flask import Flask, render_template, jsonify, request
 from flask_socketio import SocketIO, emit, join_room, leave_room
-import json
+import orjson
 import atexit
-import difflib
 import time
-from typing import Dict, Any, List, Tuple
+import threading
+import uuid
+from collections import defaultdict
+from functools import partial
+from typing import Dict, DefaultDict, Any, List, Tuple, Set
 
 current_dir = os.path.dirname(os.path.abspath(__file__))
 parent_dir = os.path.dirname(current_dir)
@@ -15,40 +26,201 @@ sys.path.append(parent_dir)
 from common.broker import RedisBroker
 from crdt.rga import RGA, Operation
 
+try:
+    from diff_match_patch import diff_match_patch
+except ImportError:
+    diff_match_patch = None
+
+try:
+    from cydifflib import SequenceMatcher
+except ImportError:
+    from difflib import SequenceMatcher
+
 REDIS_HOST = 'localhost'
 REDIS_PORT = 6379
-DOCUMENT_CHANNEL = "doc1"
+DEFAULT_DOCUMENT_ID = "doc1"
+# One site ID per process: server instances sharing Redis must not mint
+# colliding element IDs or mistake each other's ops for their own echoes.
+SERVER_SITE_ID = f"server-{uuid.uuid4()}"
+DIFF_TIMEOUT = 0.1
+TEXT_CHANGE_DEBOUNCE = 0.02
+# Compare the whole replica text with the client's after every change.
+# O(N) per edit, so off by default; app.debug is always on under socketio.run.
+VERIFY_EDITS = os.getenv('VERIFY_EDITS', '0').lower() in ('1', 'true', 'yes')
+
+def _doc_channel(doc_id: str) -> str:
+    return f"doc:{doc_id}"
 
 app = Flask(__name__, template_folder='../client/templates', static_folder='../client/static')
 app.config['SECRET_KEY'] = 'secret!changethis'
 
-socketio = SocketIO(app, async_mode='threading')
-
-doc_crdt = RGA(site_id="server")
+socketio = SocketIO(app, async_mode=ASYNC_MODE, serializer='msgpack')
+if ASYNC_MODE == 'threading':
+    print("Warning: gevent not installed, Socket.IO is using the threading async mode.")
 
 broker = RedisBroker()
 
-snapshots: Dict[str, Dict[str, Any]] = {}
+# doc_id -> replica. Each document's lock covers every read-modify-publish
+# of its replica, so edits to different documents never wait on each other.
+docs: Dict[str, RGA] = {}
+doc_locks: DefaultDict[str, threading.Lock] = defaultdict(threading.Lock)
+docs_lock = threading.Lock()
 
-connected_clients = set()
+# doc_id -> snapshot_id -> serialized state.
+snapshots: DefaultDict[str, Dict[str, bytes]] = defaultdict(dict)
+# Newest first; IDs are creation timestamps, so new ones are prepended.
+snapshot_ids_desc: DefaultDict[str, List[str]] = defaultdict(list)
 
-def handle_remote_op_from_broker(operation: Operation):
-    origin_site = operation.get('element', {}).get('id', [None, None])[1] if operation.get('type') == 'insert' else operation.get('element_id', [None, None])[1]
-    if origin_site == doc_crdt.site_id:
+# sid -> doc_id the client joined.
+connected_clients: Dict[str, str] = {}
+
+# sid -> latest (doc_id, text, cursor) received while its debounce window is open.
+pending_changes: Dict[str, Tuple[str, str, Any]] = {}
+pending_lock = threading.Lock()
+
+if diff_match_patch is not None:
+    dmp = diff_match_patch()
+    dmp.Diff_Timeout = DIFF_TIMEOUT
+else:
+    dmp = None
+    print("Warning: diff-match-patch not installed, falling back to difflib for text diffs.")
+
+def _common_prefix_len(a: str, b: str) -> int:
+    # Binary search on slice equality keeps the scan in C.
+    lo, hi = 0, min(len(a), len(b))
+    while lo < hi:
+        mid = (lo + hi + 1) // 2
+        if a[lo:mid] == b[lo:mid]:
+            lo = mid
+        else:
+            hi = mid - 1
+    return lo
+
+def _common_suffix_len(a: str, b: str, limit: int) -> int:
+    lo, hi = 0, limit
+    while lo < hi:
+        mid = (lo + hi + 1) // 2
+        if a[len(a) - mid:len(a) - lo] == b[len(b) - mid:len(b) - lo]:
+            lo = mid
+        else:
+            hi = mid - 1
+    return lo
+
+def _diff_ranges(server_text: str, client_text: str) -> Tuple[List[Tuple[int, int]], List[Tuple[int, str]]]:
+    # Deletes are ranges of server_text. Inserts are positioned in
+    # client_text, which is where they land once every delete is applied.
+    deletes: List[Tuple[int, int]] = []
+    inserts: List[Tuple[int, str]] = []
+
+    prefix = _common_prefix_len(server_text, client_text)
+    suffix = _common_suffix_len(server_text, client_text, min(len(server_text), len(client_text)) - prefix)
+    old = server_text[prefix:len(server_text) - suffix]
+    new = client_text[prefix:len(client_text) - suffix]
+    if not old or not new:
+        if old:
+            deletes.append((prefix, prefix + len(old)))
+        if new:
+            inserts.append((prefix, new))
+        return deletes, inserts
+
+    if dmp is not None:
+        diffs = dmp.diff_main(old, new)
+        dmp.diff_cleanupEfficiency(diffs)
+        i = j = prefix
+        for op, text in diffs:
+            if not text:
+                continue
+            if op == dmp.DIFF_EQUAL:
+                i += len(text)
+                j += len(text)
+            elif op == dmp.DIFF_DELETE:
+                deletes.append((i, i + len(text)))
+                i += len(text)
+            else:
+                inserts.append((j, text))
+                j += len(text)
+        return deletes, inserts
+
+    s = SequenceMatcher(None, old, new, autojunk=False)
+    for tag, i1, i2, j1, j2 in s.get_opcodes():
+        if tag in ('replace', 'delete'):
+            deletes.append((prefix + i1, prefix + i2))
+        if tag in ('replace', 'insert'):
+            inserts.append((prefix + j1, new[j1:j2]))
+    return deletes, inserts
+
+def _merge_ranges(deletes: List[Tuple[int, int]], inserts: List[Tuple[int, str]]) -> Tuple[List[Tuple[int, int]], List[Tuple[int, str]]]:
+    # Touching or overlapping deletes become one range. Inserts are in
+    # client coordinates, so one that starts where the previous ends is
+    # the same run of new text.
+    merged_deletes: List[Tuple[int, int]] = []
+    for start, end in sorted(deletes):
+        if merged_deletes and start <= merged_deletes[-1][1]:
+            merged_deletes[-1] = (merged_deletes[-1][0], max(merged_deletes[-1][1], end))
+        else:
+            merged_deletes.append((start, end))
+
+    merged_inserts: List[Tuple[int, str]] = []
+    for index, text in sorted(inserts, key=lambda x: x[0]):
+        if merged_inserts and index == merged_inserts[-1][0] + len(merged_inserts[-1][1]):
+            merged_inserts[-1] = (merged_inserts[-1][0], merged_inserts[-1][1] + text)
+        else:
+            merged_inserts.append((index, text))
+    return merged_deletes, merged_inserts
+
+def _get_doc(doc_id: str) -> RGA:
+    doc = docs.get(doc_id)
+    if doc is None:
+        with docs_lock:
+            doc = docs.get(doc_id)
+            if doc is None:
+                doc = docs[doc_id] = RGA(site_id=SERVER_SITE_ID)
+    return doc
+
+def _request_doc_id() -> str:
+    return request.args.get('doc') or DEFAULT_DOCUMENT_ID
+
+def _origin_site(operation: Operation):
+    if 'origin' in operation:
+        return operation['origin']
+    if operation.get('type') == 'insert':
+        return operation.get('element', {}).get('id', [None, None])[1]
+    if operation.get('type') == 'insert_range':
+        return operation.get('start_id', [None, None])[1]
+    if operation.get('type') == 'delete_range':
+        return (operation.get('runs') or [[None, None]])[0][1]
+    return operation.get('element_id', [None, None])[1]
+
+def handle_remote_ops_from_broker(doc_id: str, operations: List[Operation]):
+    remote_ops = [op for op in operations if _origin_site(op) != SERVER_SITE_ID]
+    if not remote_ops:
         return
 
-    print(f"Received from Broker: {operation}")
+    print(f"Received {len(remote_ops)} ops from Broker for document {doc_id}")
     try:
-        doc_crdt.apply_remote_operation(operation)
+        with doc_locks[doc_id]:
+            _get_doc(doc_id).apply_remote_operations(remote_ops)
         with app.app_context():
-            socketio.emit('operation', operation, room=DOCUMENT_CHANNEL)
-            print(f"Broadcasted op from broker via WebSocket: {operation.get('type')}")
+            socketio.emit('operations_batch', remote_ops, room=_doc_channel(doc_id))
+            print(f"Broadcasted {len(remote_ops)} ops from broker via WebSocket")
     except Exception as e:
-        print(f"Error applying/broadcasting remote op from broker: {e}")
+        print(f"Error applying/broadcasting remote ops from broker: {e}")
 
-if broker.redis_client:
-    broker.subscribe(DOCUMENT_CHANNEL, handle_remote_op_from_broker)
-else:
+subscribed_channels: Set[str] = set()
+subscription_lock = threading.Lock()
+
+def _ensure_subscribed(doc_id: str):
+    # Subscribed on the first client join and kept afterwards: dropping it
+    # when the room empties would leave the replica stale for the next one.
+    channel = _doc_channel(doc_id)
+    if not broker.redis_client or channel in subscribed_channels:
+        return
+    with subscription_lock:
+        if channel not in subscribed_channels:
+            broker.subscribe(channel, partial(handle_remote_ops_from_broker, doc_id), batch=True)
+            subscribed_channels.add(channel)
+
+if not broker.redis_client:
     print("CRITICAL: Could not connect to Redis. Real-time sync disabled.")
 
 @app.route('/')
@@ -57,24 +229,34 @@ def index():
 
 @app.route('/api/state')
 def get_state():
-    current_value = doc_crdt.get_value()
+    # Reads never create a replica: unknown documents are simply empty.
+    doc_id = _request_doc_id()
+    doc = docs.get(doc_id)
+    if doc is None:
+        return jsonify({"value": ""})
+    # get_value() fills the replica's caches, so it needs the lock too.
+    with doc_locks[doc_id]:
+        current_value = doc.get_value()
     return jsonify({"value": current_value})
 
 @app.route('/api/snapshots')
 def get_snapshots():
-    snapshot_timestamps = sorted(snapshots.keys(), reverse=True)
-    return jsonify({"snapshots": snapshot_timestamps})
+    return jsonify({"snapshots": snapshot_ids_desc.get(_request_doc_id(), [])})
 
 @socketio.on('connect')
 def handle_connect():
     sid = request.sid
-    connected_clients.add(sid)
+    doc_id = _request_doc_id()
+    connected_clients[sid] = doc_id
     print(f"Client connected: {sid}")
-    join_room(DOCUMENT_CHANNEL)
-    print(f"Client {sid} joined room: {DOCUMENT_CHANNEL}")
+    _ensure_subscribed(doc_id)
+    join_room(_doc_channel(doc_id))
+    print(f"Client {sid} joined room: {_doc_channel(doc_id)}")
 
     try:
-        current_value = doc_crdt.get_value()
+        doc = _get_doc(doc_id)
+        with doc_locks[doc_id]:
+            current_value = doc.get_value()
         emit('initial_state', {'value': current_value})
         print(f"Sent initial state to {sid}: {current_value[:50]}...")
     except Exception as e:
@@ -83,106 +265,121 @@ def handle_connect():
 @socketio.on('disconnect')
 def handle_disconnect():
     sid = request.sid
-    connected_clients.discard(sid)
-    leave_room(DOCUMENT_CHANNEL)
+    doc_id = connected_clients.pop(sid, DEFAULT_DOCUMENT_ID)
+    leave_room(_doc_channel(doc_id))
     print(f"Client disconnected: {sid}")
 
 @socketio.on('text_change')
 def handle_text_change(data: Dict[str, Any]):
     sid = request.sid
-    client_text = data.get('value', '')
-    cursor_pos = data.get('cursor', None)
-
-    server_text = doc_crdt.get_value()
+    doc_id = connected_clients.get(sid, DEFAULT_DOCUMENT_ID)
+    with pending_lock:
+        # Only the latest text of a burst is diffed; ops for the earlier
+        # ones would be superseded straight away.
+        already_scheduled = sid in pending_changes
+        pending_changes[sid] = (doc_id, data.get('value', ''), data.get('cursor', None))
+    if not already_scheduled:
+        socketio.start_background_task(_debounced_apply, sid)
+
+def _debounced_apply(sid: str):
+    socketio.sleep(TEXT_CHANGE_DEBOUNCE)
+    with app.app_context():
+        _flush_pending_change(sid)
+
+def _flush_pending_change(sid: str):
+    with pending_lock:
+        pending = pending_changes.get(sid)
+    if pending is None:
+        return
+    doc_id = pending[0]
+    # Popped under the document lock, so a revert that drops pending
+    # changes cannot be overtaken by one already taken off the map.
+    with doc_locks[doc_id]:
+        with pending_lock:
+            pending = pending_changes.pop(sid, None)
+        if pending is not None:
+            _apply_text_change(sid, *pending)
+
+def _apply_text_change(sid: str, doc_id: str, client_text: str, cursor_pos: Any):
+    # Caller holds doc_locks[doc_id].
+    doc = _get_doc(doc_id)
+    channel = _doc_channel(doc_id)
+    server_text = doc.get_value()
 
     if client_text == server_text:
         return
 
-    s = difflib.SequenceMatcher(None, server_text, client_text, autojunk=False)
-    opcodes = s.get_opcodes()
-
     ops_to_broadcast = []
     error_occurred = False
 
     try:
-        deletes_to_process: List[Tuple[int, int]] = []
-        inserts_to_process: List[Tuple[int, str]] = []
-
-        for tag, i1, i2, j1, j2 in opcodes:
-            if tag == 'replace':
-                deletes_to_process.append((i1, i2))
-                inserts_to_process.append((i1, client_text[j1:j2]))
-            elif tag == 'delete':
-                deletes_to_process.append((i1, i2))
-            elif tag == 'insert':
-                inserts_to_process.append((i1, client_text[j1:j2]))
+        deletes_to_process, inserts_to_process = _merge_ranges(*_diff_ranges(server_text, client_text))
 
         deletes_to_process.sort(key=lambda x: x[0], reverse=True)
         for start, end in deletes_to_process:
-            for idx in range(end - 1, start - 1, -1):
-                try:
-                    delete_op = doc_crdt.local_delete(idx)
-                    if delete_op and delete_op['type'] != 'noop':
-                         ops_to_broadcast.append(delete_op)
-                except IndexError as ie:
-                    print(f"ERROR generating delete op at index {idx}: {ie}")
-                    error_occurred = True
-                    break
-            if error_occurred: break
+            try:
+                delete_op = doc.local_delete_range(start, end)
+                if delete_op['type'] != 'noop':
+                     ops_to_broadcast.append(delete_op)
+            except IndexError as ie:
+                print(f"ERROR generating delete op for range {start}-{end}: {ie}")
+                error_occurred = True
+                break
 
         if error_occurred:
              raise RuntimeError("Error occurred during delete operation generation.")
 
         inserts_to_process.sort(key=lambda x: x[0])
         for index, text in inserts_to_process:
-            for k, char_to_insert in enumerate(text):
-                insertion_idx = index + k
-                try:
-                    insert_op = doc_crdt.local_insert(insertion_idx, char_to_insert)
-                    if insert_op and insert_op['type'] != 'noop':
-                         ops_to_broadcast.append(insert_op)
-                except IndexError as ie:
-                    print(f"ERROR generating insert op at index {insertion_idx}: {ie}")
-                    error_occurred = True
-                    break
-            if error_occurred: break
+            try:
+                ops_to_broadcast.append(doc.local_insert_range(index, text))
+            except IndexError as ie:
+                print(f"ERROR generating insert op at index {index}: {ie}")
+                error_occurred = True
+                break
 
         if error_occurred:
              raise RuntimeError("Error occurred during insert operation generation.")
 
-        final_server_text = doc_crdt.get_value()
-        if final_server_text != client_text:
+        # The length check is O(1) on the cached visible list; the full
+        # text comparison only runs with VERIFY_EDITS set.
+        if doc.get_length() != len(client_text) or (VERIFY_EDITS and doc.get_value() != client_text):
+            final_server_text = doc.get_value()
             print(f"WARNING: Server text after ops ({len(final_server_text)}) doesn't match client text ({len(client_text)})!")
-            emit('full_state_update', {'value': final_server_text}, room=DOCUMENT_CHANNEL)
+            socketio.emit('full_state_update', {'value': final_server_text}, room=channel)
 
         if not ops_to_broadcast:
              return
 
-        for op in ops_to_broadcast:
-            if broker.redis_client:
-                broker.publish(DOCUMENT_CHANNEL, op)
-            else:
-                print("Warning: Redis not connected, cannot publish operation.")
+        if broker.redis_client:
+            broker.publish_many(channel, ops_to_broadcast)
+        else:
+            print("Warning: Redis not connected, cannot publish operations.")
 
-            emit('operation', op, room=DOCUMENT_CHANNEL, skip_sid=sid)
+        socketio.emit('operations_batch', ops_to_broadcast, room=channel, skip_sid=sid)
 
     except IndexError as e:
          print(f"ERROR during op generation (likely index issue): {e}. Client: {sid}")
-         emit('error', {'message': 'Server error processing change. Please reload.'}, room=sid)
+         socketio.emit('error', {'message': 'Server error processing change. Please reload.'}, room=sid)
     except Exception as e:
         print(f"ERROR processing text_change from {sid}: {e}")
-        emit('error', {'message': f'Server error: {e}'}, room=sid)
+        socketio.emit('error', {'message': f'Server error: {e}'}, room=sid)
 
 @socketio.on('create_snapshot')
 def handle_create_snapshot():
     sid = request.sid
+    doc_id = connected_clients.get(sid, DEFAULT_DOCUMENT_ID)
     print(f"Received create_snapshot request from {sid}")
+    _flush_pending_change(sid)
     try:
         snapshot_id = time.strftime("%Y-%m-%d_%H-%M-%S")
-        snapshots[snapshot_id] = doc_crdt.serialize_state()
-        print(f"Snapshot created: {snapshot_id}")
-        snapshot_timestamps = sorted(snapshots.keys(), reverse=True)
-        emit('snapshots_updated', {'snapshots': snapshot_timestamps}, room=DOCUMENT_CHANNEL)
+        with doc_locks[doc_id]:
+            state = orjson.dumps(_get_doc(doc_id).serialize_state())
+        if snapshot_id not in snapshots[doc_id]:
+            snapshot_ids_desc[doc_id].insert(0, snapshot_id)
+        snapshots[doc_id][snapshot_id] = state
+        print(f"Snapshot created: {snapshot_id} for document {doc_id}")
+        emit('snapshots_updated', {'snapshots': snapshot_ids_desc[doc_id]}, room=_doc_channel(doc_id))
 
     except Exception as e:
         print(f"Error creating snapshot: {e}")
@@ -191,6 +388,7 @@ def handle_create_snapshot():
 @socketio.on('revert_to_snapshot')
 def handle_revert_to_snapshot(data: Dict[str, str]):
     sid = request.sid
+    doc_id = connected_clients.get(sid, DEFAULT_DOCUMENT_ID)
     snapshot_id = data.get('id')
 
     if not snapshot_id:
@@ -198,16 +396,23 @@ def handle_revert_to_snapshot(data: Dict[str, str]):
         emit('error', {'message': 'No snapshot ID provided'}, room=sid)
         return
 
-    if snapshot_id not in snapshots:
+    if snapshot_id not in snapshots.get(doc_id, {}):
         print(f"Error: Snapshot ID '{snapshot_id}' not found (requested by {sid})")
         emit('error', {'message': 'Snapshot  not found'}, room=sid)
         return
 
     print(f"Reverting document state to snapshot: {snapshot_id} (requested by {sid})")
     try:
-        doc_crdt.load_state(snapshots[snapshot_id])
-        current_value = doc_crdt.get_value()
-        emit('full_state_update', {'value': current_value}, room=DOCUMENT_CHANNEL)
+        doc = _get_doc(doc_id)
+        with doc_locks[doc_id]:
+            # Edits still inside their debounce window predate the revert;
+            # applying them afterwards would diff the old text back in.
+            with pending_lock:
+                for pending_sid in [p_sid for p_sid, pending in pending_changes.items() if pending[0] == doc_id]:
+                    del pending_changes[pending_sid]
+            doc.load_state(orjson.loads(snapshots[doc_id][snapshot_id]))
+            current_value = doc.get_value()
+        emit('full_state_update', {'value': current_value}, room=_doc_channel(doc_id))
         print(f"Broadcasted full state update after revert to snapshot {snapshot_id}")
 
     except Exception as e: